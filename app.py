@@ -1,17 +1,112 @@
 from flask import Flask, render_template, jsonify, request
 import datetime
 import requests
+from requests.adapters import HTTPAdapter
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from pymavlink import mavutil
+import math
+import queue
+import re
+import sched
+import selectors
 import threading
 import time
 import json
+import logging
+from dataclasses import dataclass
 from typing import Optional
 
+try:
+    import orjson  # быстрый C-сериализатор; опционален
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np  # векторный разбор больших .plan; опционален
+except ImportError:
+    np = None
+
+# Логгер для горячих путей загрузки/арминга: %-форматирование ленивое,
+# на выключенном уровне строка сообщения вообще не собирается
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
+
+def _json_bytes(obj) -> bytes:
+    """Сериализация в JSON-байты: orjson, если установлен, иначе stdlib."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def fast_json(obj, status: int = 200):
+    """Ответ application/json в обход jsonify (без прохода через stdlib json)."""
+    return app.response_class(_json_bytes(obj), status=status, mimetype="application/json")
+
 UAVS = {}
 MAVLINK_CONNECTIONS = {}
+# Глобальный лок — только для изменения СОСТАВА словарей (добавление/удаление БВС)
 uavs_lock = threading.Lock()
+# Отдельный лок на каждый БВС: обновления телеметрии разных бортов не конкурируют
+UAV_LOCKS = {}
+# Борта, отключённые пользователем вручную: периодический rescan их не трогает
+# (иначе вещающий борт переподключался бы через 30 с, теряя загруженную миссию).
+# Защищается uavs_lock.
+USER_DISCONNECTED = set()
+# Неизменяемый снимок состояния для читателей (/uavs и т.п.).
+# Заменяется целиком после пакета обновлений, читается без какого-либо лока.
+UAVS_SNAPSHOT = ()
+# Версия данных: растёт при каждой публикации снимка. По ней /uavs понимает,
+# что закэшированный JSON ещё свежий и сериализовать заново не нужно.
+_data_version = 0
+# Флаг «состояние изменилось»: писатели только взводят его, а пересборкой
+# снимка занимается один фоновый поток — шквал телеметрии схлопывается
+# максимум в ~10 пересборок в секунду вместо пересборки на каждое сообщение.
+_snapshot_dirty = threading.Event()
+
+
+def _mark_dirty() -> None:
+    """Помечает состояние изменённым; снимок пересоберёт фоновый поток."""
+    _snapshot_dirty.set()
+
+
+def _snapshot_rebuilder() -> None:
+    """Фоновый поток: ждёт флага изменений и публикует снимок раз на пачку."""
+    while True:
+        _snapshot_dirty.wait()
+        # короткая пауза, чтобы собрать пачку обновлений в одну пересборку
+        time.sleep(0.1)
+        _snapshot_dirty.clear()
+        _publish_snapshot()
+
+
+def _publish_snapshot() -> None:
+    """
+    Пересобирает UAVS_SNAPSHOT из свежих копий словарей БВС.
+    Писатели вызывают это после пакета изменений; читатели просто берут
+    текущий кортеж — подмена ссылки атомарна, локи им не нужны.
+    """
+    global UAVS_SNAPSHOT, _data_version
+    # копируем только ключи под глобальным локом; локи берём вне его
+    with uavs_lock:
+        ids = list(UAVS)
+
+    snapshot = []
+    for uav_id in ids:
+        uav_lock = UAV_LOCKS.get(uav_id)
+        if uav_lock is None:
+            continue
+        with uav_lock:
+            uav = UAVS.get(uav_id)
+            if uav is not None:
+                snapshot.append(dict(uav))
+
+    UAVS_SNAPSHOT = tuple(snapshot)
+    with uavs_lock:
+        _data_version += 1
 
 # IP Repka Pi по Tailscale (адрес внутри Headscale-сети)
 REPKA_IP = "localhost"
@@ -41,10 +136,19 @@ def connect_to_uav(port: int) -> bool:
             mavutil.mavlink.MAV_STATE_ACTIVE
         )
 
-        # Ждём heartbeat от борта
-        msg = master.wait_heartbeat(timeout=5)
+        # Ждём heartbeat от борта. Таймаут короткий: обнаружение периодическое,
+        # не ответивший сейчас порт попробуем снова через DISCOVER_INTERVAL
+        msg = master.wait_heartbeat(timeout=1)
 
         if msg:
+            # Сразу переводим сокет в неблокирующий режим: дальше слушаем его
+            # только через recv_match(blocking=False) + select, поэтому
+            # pymavlink не должен переключать режим/таймаут на каждом вызове.
+            try:
+                master.port.setblocking(False)
+            except (AttributeError, OSError):
+                pass
+
             uav_id = f"uav_{port}"
             with uavs_lock:
                 UAVS[uav_id] = {
@@ -58,7 +162,11 @@ def connect_to_uav(port: int) -> bool:
                     "port": port,
                     "status": "online",
                     "mission": [],
-                    "last_heartbeat": datetime.datetime.utcnow().isoformat(),
+                    # сырой epoch; ISO-строка для JSON собирается лениво
+                    # при сериализации, а не на каждом сообщении
+                    "last_heartbeat_ts": time.time(),
+                    # монотонное время для проверки таймаутов (не зависит от NTP)
+                    "last_heartbeat_monotonic": time.monotonic(),
                     "connected": True,
                     "gps_fix": 0,
                     "satellites": 0,
@@ -81,6 +189,16 @@ def connect_to_uav(port: int) -> bool:
                     "mission_comm_lock": False,
                 }
                 MAVLINK_CONNECTIONS[uav_id] = master
+                UAV_LOCKS[uav_id] = threading.Lock()
+
+            _mark_dirty()
+
+            # Сразу подбираем режим аварийной остановки, чтобы /mission/stop
+            # не ходил в mode_mapping в момент нажатия «стоп»
+            try:
+                _stop_mode_id(master)
+            except Exception:
+                pass
 
             print(f"[CONNECT] Успешно получили HEARTBEAT от БВС на порту {port}")
             return True
@@ -93,190 +211,525 @@ def connect_to_uav(port: int) -> bool:
     return False
 
 
-def listen_to_uav(uav_id: str) -> None:
-    """Фоновый поток: приём MAVLink-сообщений и обновление состояния БВС."""
-    while True:
-        try:
-            with uavs_lock:
-                if uav_id not in UAVS or not UAVS[uav_id].get("connected", True):
-                    break
-                master = MAVLINK_CONNECTIONS.get(uav_id)
-                telemetry_enabled = UAVS[uav_id].get("telemetry_enabled", True)
-                mission_lock = UAVS[uav_id].get("mission_comm_lock", False)
+# Кэш ISO-строки времени: (время с шагом 100 мс, готовая строка)
+_iso_cache = (0, "")
 
-            if not master:
-                break
 
-            # Если идёт загрузка/арминг миссии — не читаем из сокета, чтобы не мешать протоколу
-            if not telemetry_enabled or mission_lock:
-                time.sleep(0.05)
+def _fast_utcnow_iso() -> str:
+    """
+    ISO-строка текущего UTC, мемоизированная с шагом 100 мс.
+    Полям вроде last_mission_update суб-миллисекундная точность не нужна,
+    а datetime+isoformat на каждом сообщении — лишняя аллокация.
+    """
+    global _iso_cache
+    key = int(time.time() * 10)
+    cached_key, cached = _iso_cache
+    if cached_key != key:
+        cached = datetime.datetime.utcfromtimestamp(key / 10).isoformat()
+        _iso_cache = (key, cached)
+    return cached
+
+
+# --- Обработчики MAVLink-сообщений ---
+# Каждый обработчик получает словарь БВС и сообщение; вызывающий код держит
+# per-UAV лок. Диспетчеризация по таблице — один dict-lookup вместо цепочки
+# строковых сравнений на каждое сообщение.
+
+def _handle_heartbeat(uav, msg):
+    uav["last_heartbeat_ts"] = time.time()
+    uav["last_heartbeat_monotonic"] = time.monotonic()
+    uav["status"] = "online"
+    # Состояние арминга из base_mode: старт миссии берёт свежее значение
+    # отсюда и не тратит до 3 с на собственный опрос HEARTBEAT
+    uav["armed"] = bool(msg.base_mode & _ARMED_FLAG)
+    uav["armed_ts"] = uav["last_heartbeat_monotonic"]
+
+
+def _handle_global_position_int(uav, msg):
+    uav["lat"] = msg.lat / 1e7
+    uav["lon"] = msg.lon / 1e7
+    uav["alt"] = msg.relative_alt / 1000.0
+    uav["heading"] = msg.hdg / 100
+
+
+def _handle_vfr_hud(uav, msg):
+    # pymavlink уже отдаёт float/int нужного типа — лишние касты убраны
+    uav["ground_speed"] = msg.groundspeed
+
+
+def _handle_gps_raw_int(uav, msg):
+    uav["gps_fix"] = msg.fix_type
+    uav["satellites"] = msg.satellites_visible
+
+
+def _handle_sys_status(uav, msg):
+    # Статус системы, в т.ч. батарея
+    percent = msg.battery_remaining
+    voltage = msg.voltage_battery
+    if percent is not None and percent >= 0:
+        uav["battery_percent"] = int(percent)
+    if voltage is not None and voltage > 0:
+        uav["battery_voltage"] = round(voltage / 1000.0, 2)
+
+
+def _handle_mission_current(uav, msg):
+    current_wp = msg.seq
+    status = uav.get("mission_status", "idle")
+
+    # Если миссия остановлена — игнорируем дальнейшие MISSION_CURRENT
+    if status == "stopped":
+        return
+
+    total = uav.get("mission_total") or len(uav.get("mission", [])) or 0
+    progress = 0.0
+    if total > 0:
+        progress = min(1.0, max(0.0, (current_wp + 1) / total))
+    uav["mission_current_seq"] = current_wp
+    uav["mission_progress"] = progress
+    uav["last_mission_update"] = _fast_utcnow_iso()
+
+    # лог для отладки
+    print(f"[MISSION] MISSION_CURRENT {uav['id']}: seq={current_wp}/{total}")
+
+    # если дошли до конца — считаем миссию завершённой
+    if total > 0 and current_wp >= total - 1:
+        uav["mission_status"] = "completed"
+        uav["mission_phase"] = "completed"
+        print(f"[MISSION] {uav['id']} completed by MISSION_CURRENT")
+
+
+# Признаки завершения миссии в STATUSTEXT. Скомпилированный regex по сырым
+# байтам вместо .decode() + .lower() + двух substring-проверок на сообщение.
+_STATUS_DONE_RE = re.compile(rb"mission complete|landed", re.IGNORECASE)
+
+
+def _handle_statustext(uav, msg):
+    raw = msg.text if isinstance(msg.text, bytes) else str(msg.text).encode('utf-8')
+    # декодируем только ради лога, сам матч идёт по байтам
+    print(f"[STATUSTEXT] {uav['id']}: {raw.decode('utf-8', errors='replace')}")
+    if _STATUS_DONE_RE.search(raw):
+        # не переходим в completed, если уже stopped — стоп важнее
+        if uav.get("mission_status") != "stopped":
+            uav["mission_status"] = "completed"
+            uav["mission_phase"] = "completed"
+            uav["last_mission_update"] = _fast_utcnow_iso()
+            print(f"[MISSION] {uav['id']} completed by STATUSTEXT")
+
+
+HANDLERS = {
+    'HEARTBEAT': _handle_heartbeat,
+    'GLOBAL_POSITION_INT': _handle_global_position_int,
+    'VFR_HUD': _handle_vfr_hud,
+    'GPS_RAW_INT': _handle_gps_raw_int,
+    'SYS_STATUS': _handle_sys_status,
+    'MISSION_CURRENT': _handle_mission_current,
+    'STATUSTEXT': _handle_statustext,
+}
+
+
+# Селектор, мультиплексирующий UDP-сокеты всех бортов в одном потоке:
+# поток на каждый БВС не нужен (стек ~8 МБ и конкуренция за GIL на каждом).
+# Регистрацией/снятием сокетов занимается только сам цикл телеметрии,
+# поэтому селектор не требует межпоточной синхронизации.
+_selector = selectors.DefaultSelector()
+# uav_id -> зарегистрированный сокет
+_registered_socks = {}
+
+
+def _sync_selector() -> None:
+    """
+    Приводит набор зарегистрированных сокетов к текущему составу соединений.
+    Борт на паузе (telemetry_enabled=False или mission_comm_lock) снимается
+    с селектора — иначе готовый к чтению сокет крутил бы цикл вхолостую,
+    пока протокол миссии читает его из другого потока.
+    """
+    desired = {}
+    for uav_id, master in list(MAVLINK_CONNECTIONS.items()):
+        uav_lock = UAV_LOCKS.get(uav_id)
+        if uav_lock is None:
+            continue
+        with uav_lock:
+            uav = UAVS.get(uav_id)
+            active = (
+                uav is not None
+                and uav.get("connected", True)
+                and uav.get("telemetry_enabled", True)
+                and not uav.get("mission_comm_lock", False)
+            )
+        sock = getattr(master, "port", None)
+        if active and sock is not None:
+            desired[uav_id] = sock
+
+    for uav_id in list(_registered_socks):
+        if desired.get(uav_id) is not _registered_socks[uav_id]:
+            try:
+                _selector.unregister(_registered_socks[uav_id])
+            except (KeyError, OSError, ValueError):
+                pass
+            del _registered_socks[uav_id]
+
+    for uav_id, sock in desired.items():
+        if uav_id not in _registered_socks:
+            try:
+                _selector.register(sock, selectors.EVENT_READ, uav_id)
+                _registered_socks[uav_id] = sock
+            except (KeyError, OSError, ValueError):
                 continue
 
-            msg = master.recv_match(blocking=True, timeout=1)
 
+# Очередь принятых сообщений: цикл телеметрии (producer) только читает
+# сокеты и кладёт (uav_id, msg), не трогая локов, — UDP-буфер опустошается
+# даже когда состояние заняты обновлять/сериализовать другие потоки.
+# Применяет обновления один consumer-поток, пачками под одним локом.
+_rx_queue = queue.SimpleQueue()
+
+
+def _drain_uav(uav_id: str) -> None:
+    """
+    Вычерпывает готовые сообщения одного борта в очередь. Локов не берёт;
+    лимит — страховка, чтобы болтливый борт не задерживал обслуживание
+    остальных сокетов.
+    """
+    master = MAVLINK_CONNECTIONS.get(uav_id)
+    if master is None:
+        return
+
+    try:
+        drained = 0
+        while drained < 64:
+            msg = master.recv_match(blocking=False)
             if not msg:
+                break
+            _rx_queue.put_nowait((uav_id, msg))
+            drained += 1
+
+    except Exception as e:
+        print(f"[LISTEN] Ошибка при прослушивании {uav_id}: {e}")
+        # Только статус, соединение не рвём — борт ещё может ожить
+        uav_lock = UAV_LOCKS.get(uav_id)
+        if uav_lock is not None:
+            with uav_lock:
+                if uav_id in UAVS:
+                    UAVS[uav_id]["status"] = "offline"
+            _mark_dirty()
+
+
+def _apply_batch(batch) -> None:
+    """Применяет пачку (uav_id, msg): группировка по борту, один лок на борт."""
+    by_uav = {}
+    for uav_id, msg in batch:
+        by_uav.setdefault(uav_id, []).append(msg)
+
+    changed = False
+    for uav_id, msgs in by_uav.items():
+        uav_lock = UAV_LOCKS.get(uav_id)
+        if uav_lock is None:
+            continue
+        with uav_lock:
+            uav = UAVS.get(uav_id)
+            if uav is None:
                 continue
+            for m in msgs:
+                handler = HANDLERS.get(m.get_type())
+                if handler is not None:
+                    try:
+                        handler(uav, m)
+                    except Exception as e:
+                        print(f"[LISTEN] Ошибка обработчика {uav_id}: {e}")
+        changed = True
+
+    if changed:
+        # После обработанной пачки публикуем свежий снимок
+        _mark_dirty()
+
+
+def _rx_consumer() -> None:
+    """Consumer-поток: забирает сообщения из очереди и применяет пачками."""
+    while True:
+        batch = [_rx_queue.get()]
+        while len(batch) < 64:
+            try:
+                batch.append(_rx_queue.get_nowait())
+            except queue.Empty:
+                break
+        _apply_batch(batch)
+
+
+def telemetry_loop() -> None:
+    """
+    Единственный поток приёма телеметрии: selectors.DefaultSelector (epoll на
+    Linux) ждёт данные сразу на всех MAVLink-сокетах, число потоков не растёт
+    с числом бортов. Новые соединения подхватываются на следующей итерации.
+    """
+    # GCS→UAV heartbeat шлём прямо из этого цикла — отдельный поток-таймер
+    # не нужен. Без периодического heartbeat ArduPilot через несколько секунд
+    # убирает GCS из списка активных и может уйти в failsafe.
+    last_hb_sent = {}
 
-            msg_type = msg.get_type()
-
-            if msg_type == 'HEARTBEAT':
-                with uavs_lock:
-                    if uav_id in UAVS:
-                        UAVS[uav_id]["last_heartbeat"] = datetime.datetime.utcnow().isoformat()
-                        UAVS[uav_id]["status"] = "online"
-
-            elif msg_type == 'GLOBAL_POSITION_INT':
-                with uavs_lock:
-                    if uav_id in UAVS:
-                        UAVS[uav_id]["lat"] = msg.lat / 1e7
-                        UAVS[uav_id]["lon"] = msg.lon / 1e7
-                        UAVS[uav_id]["alt"] = msg.relative_alt / 1000.0
-                        UAVS[uav_id]["heading"] = msg.hdg / 100
-
-            elif msg_type == 'VFR_HUD':
-                with uavs_lock:
-                    if uav_id in UAVS:
-                        UAVS[uav_id]["ground_speed"] = float(msg.groundspeed)
-
-            elif msg_type == 'GPS_RAW_INT':
-                with uavs_lock:
-                    if uav_id in UAVS:
-                        UAVS[uav_id]["gps_fix"] = msg.fix_type
-                        UAVS[uav_id]["satellites"] = msg.satellites_visible
-
-            elif msg_type == 'SYS_STATUS':
-                # Статус системы, в т.ч. батарея
-                with uavs_lock:
-                    if uav_id in UAVS:
-                        percent = msg.battery_remaining
-                        voltage = msg.voltage_battery
-                        if percent is not None and percent >= 0:
-                            UAVS[uav_id]["battery_percent"] = int(percent)
-                        if voltage is not None and voltage > 0:
-                            UAVS[uav_id]["battery_voltage"] = round(voltage / 1000.0, 2)
-
-            elif msg_type == 'MISSION_CURRENT':
-                current_wp = msg.seq
-                with uavs_lock:
-                    if uav_id not in UAVS:
-                        continue
-                    uav = UAVS[uav_id]
-                    status = uav.get("mission_status", "idle")
-
-                    # Если миссия остановлена — игнорируем дальнейшие MISSION_CURRENT
-                    if status == "stopped":
-                        # Можно раскомментировать, если хочешь видеть это в логах:
-                        # print(f"[MISSION] {uav_id} stopped, ignoring MISSION_CURRENT seq={current_wp}")
-                        continue
-
-                    total = uav.get("mission_total") or len(uav.get("mission", [])) or 0
-                    progress = 0.0
-                    if total > 0:
-                        progress = min(1.0, max(0.0, (current_wp + 1) / total))
-                    uav["mission_current_seq"] = int(current_wp)
-                    uav["mission_progress"] = progress
-                    uav["last_mission_update"] = datetime.datetime.utcnow().isoformat()
-
-                    # лог для отладки
-                    print(f"[MISSION] MISSION_CURRENT {uav_id}: seq={current_wp}/{total}")
-
-                    # если дошли до конца — считаем миссию завершённой
-                    if total > 0 and current_wp >= total - 1:
-                        uav["mission_status"] = "completed"
-                        uav["mission_phase"] = "completed"
-                        print(f"[MISSION] {uav_id} completed by MISSION_CURRENT")
-
-            elif msg_type == 'STATUSTEXT':
-                text = msg.text.decode('utf-8') if isinstance(msg.text, bytes) else str(msg.text)
-                print(f"[STATUSTEXT] {uav_id}: {text}")
-                low = text.lower()
-                if "mission complete" in low or "landed" in low:
-                    with uavs_lock:
-                        if uav_id in UAVS:
-                            uav = UAVS[uav_id]
-                            # не переходим в completed, если уже stopped — стоп важнее
-                            if uav.get("mission_status") != "stopped":
-                                uav["mission_status"] = "completed"
-                                uav["mission_phase"] = "completed"
-                                uav["last_mission_update"] = datetime.datetime.utcnow().isoformat()
-                                print(f"[MISSION] {uav_id} completed by STATUSTEXT")
+    while True:
+        try:
+            _sync_selector()
+
+            # Периодический heartbeat от GCS. Интервал растёт как sqrt(N),
+            # чтобы при большом числе бортов не забивать канал служебкой.
+            now = time.monotonic()
+            hb_interval = max(0.5, 0.5 * math.sqrt(len(UAVS) or 1))
+            for uav_id in _registered_socks:
+                if now - last_hb_sent.get(uav_id, 0.0) > hb_interval:
+                    master = MAVLINK_CONNECTIONS.get(uav_id)
+                    if master is not None:
+                        try:
+                            master.mav.heartbeat_send(
+                                mavutil.mavlink.MAV_TYPE_GCS,
+                                mavutil.mavlink.MAV_AUTOPILOT_INVALID,
+                                0, 0,
+                                mavutil.mavlink.MAV_STATE_ACTIVE
+                            )
+                        except Exception:
+                            pass
+                    last_hb_sent[uav_id] = now
+
+            # Таймаут короткий: он же задаёт периодичность _sync_selector,
+            # т.е. задержку подхвата новых бортов и снятия бортов на паузе
+            events = _selector.select(timeout=1.0)
+            for key, _ in events:
+                _drain_uav(key.data)
 
         except Exception as e:
-            print(f"[LISTEN] Ошибка при прослушивании {uav_id}: {e}")
-            # Только статус, соединение не рвём — пусть поток ещё попробует
-            with uavs_lock:
-                if uav_id in UAVS:
-                    UAVS[uav_id]["status"] = "offline"
+            print(f"[LISTEN] Ошибка цикла телеметрии: {e}")
             time.sleep(1)
 
 
 def discover_uavs() -> None:
-    """Одноразовое обнаружение БВС на фиксированном диапазоне портов."""
-    ports = range(14550, 14551)  # пока один порт, можно расширить
-
-    print(f"[DISCOVER] Сканирование портов {list(ports)}...")
+    """Обнаружение БВС на фиксированном диапазоне портов (уже подключённые пропускаем)."""
+    ports = range(14550, 14560)
 
-    for port in ports:
-        uav_id = f"uav_{port}"
-        with uavs_lock:
+    candidates = []
+    with uavs_lock:
+        for port in ports:
+            uav_id = f"uav_{port}"
+            if uav_id in USER_DISCONNECTED:
+                continue
             if uav_id in UAVS and UAVS[uav_id].get("connected", False):
                 continue
+            candidates.append(port)
+
+    if not candidates:
+        return
 
-        if connect_to_uav(port):
-            thread = threading.Thread(target=listen_to_uav, args=(uav_id,), daemon=True)
-            thread.start()
+    print(f"[DISCOVER] Сканирование портов {candidates}...")
+
+    # Параллельный скан: время прохода — максимум из таймаутов по портам,
+    # а не их сумма
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        executor.map(connect_to_uav, candidates)
+    # Отдельные потоки прослушивания не нужны: цикл телеметрии сам
+    # зарегистрирует сокеты новых бортов на следующей итерации
+
+
+TIMEOUT_OFFLINE = 60  # секунд без heartbeat, после чего считаем оффлайн
 
 
 def check_heartbeats() -> None:
     """
-    Периодическая проверка активности БВС по времени последнего HEARTBEAT.
+    Один проход проверки активности БВС по времени последнего HEARTBEAT.
     ВАЖНО: только меняем status, флаг connected не трогаем и соединение не рвём.
+    Периодический запуск — через управляющий поток-планировщик.
     """
-    TIMEOUT_OFFLINE = 60  # секунд без heartbeat, после чего считаем оффлайн
+    # Монотонные часы: простое вычитание float вместо парсинга ISO-строки,
+    # и перевод системных часов (NTP) не роняет все борта в offline
+    now = time.monotonic()
+    # Под глобальным локом — только список id (без кортежей с локами);
+    # сами локи добираем атомарным dict.get уже вне критической секции
+    with uavs_lock:
+        ids = list(UAVS)
 
-    while True:
-        current_time = datetime.datetime.utcnow()
-        with uavs_lock:
-            for uav_id, uav in list(UAVS.items()):
-                last = uav.get("last_heartbeat")
-                if last:
-                    last_dt = datetime.datetime.fromisoformat(last)
-                    if (current_time - last_dt).total_seconds() > TIMEOUT_OFFLINE:
-                        uav["status"] = "offline"
-        time.sleep(5)
+    changed = False
+    for uav_id in ids:
+        uav_lock = UAV_LOCKS.get(uav_id)
+        if uav_lock is None:
+            continue
+        probe_master = None
+        with uav_lock:
+            uav = UAVS.get(uav_id)
+            if not uav:
+                continue
+            last = uav.get("last_heartbeat_monotonic")
+            if last is None:
+                continue
 
+            delta = now - last
+            if delta < 0:
+                # скачок часов/выход из сна — не верим отрицательной дельте
+                uav["last_heartbeat_monotonic"] = now
+                continue
 
-def get_serializable_uavs():
-    """Сериализация структуры UAVS в список объектов, готовых к JSON."""
-    with uavs_lock:
-        uavs_list = []
-        for _, uav_data in UAVS.items():
-            serializable_uav = dict(uav_data)
-            uavs_list.append(serializable_uav)
+            if delta <= TIMEOUT_OFFLINE:
+                continue
 
-        uavs_list.sort(key=lambda x: x["port"])
-        return uavs_list
+            status = uav.get("status")
+            if status == "checking":
+                # просрочка второй тик подряд — теперь действительно offline
+                uav["status"] = "offline"
+                changed = True
+            elif status != "offline":
+                # Первый страйк: не роняем в offline сразу (пауза хоста или
+                # потерянный пакет — не повод для alarm-шторма в UI), а шлём
+                # пробный heartbeat и ждём один цикл ответа.
+                uav["status"] = "checking"
+                probe_master = MAVLINK_CONNECTIONS.get(uav_id)
+                changed = True
+
+        if probe_master is not None:
+            try:
+                probe_master.mav.heartbeat_send(
+                    mavutil.mavlink.MAV_TYPE_GCS,
+                    mavutil.mavlink.MAV_AUTOPILOT_INVALID,
+                    0, 0,
+                    mavutil.mavlink.MAV_STATE_ACTIVE
+                )
+            except Exception:
+                pass
+
+    if changed:
+        _mark_dirty()
+
+
+def get_serializable_uavs():
+    """
+    Сериализация состояния БВС в список объектов, готовых к JSON.
+    Читает UAVS_SNAPSHOT без локов — писателей не блокируем.
+    """
+    uavs_list = []
+    for uav_data in UAVS_SNAPSHOT:
+        uav = dict(uav_data)
+        # наружу отдаём только ISO-строку last_heartbeat; форматируем её
+        # здесь, лениво, а не в телеметрийном цикле на каждом HEARTBEAT
+        ts = uav.pop("last_heartbeat_ts", None)
+        uav["last_heartbeat"] = (
+            datetime.datetime.utcfromtimestamp(ts).isoformat() if ts else None
+        )
+        uav.pop("last_heartbeat_monotonic", None)
+        # внутренний кэш подготовленной миссии наружу не отдаём
+        uav.pop("_prepared_mission", None)
+        uavs_list.append(uav)
+    uavs_list.sort(key=lambda x: x["port"])
+    return uavs_list
 
 
 def update_mission_state(uav_id: str, **kwargs) -> None:
     """Атомарно обновляет поля состояния миссии в UAVS[uav_id]."""
     with uavs_lock:
+        uav_lock = UAV_LOCKS.get(uav_id)
+    if uav_lock is None:
+        return
+
+    with uav_lock:
         uav = UAVS.get(uav_id)
         if not uav:
             return
         uav.update(kwargs)
-        uav["last_mission_update"] = datetime.datetime.utcnow().isoformat()
+        uav["last_mission_update"] = _fast_utcnow_iso()
+    _mark_dirty()
 
 
 # ==========================
 #   ПАРСИНГ .PLAN ДЛЯ UI
 # ==========================
 
+# Константы разбора, поднятые на уровень модуля: не резолвим
+# mavutil.mavlink.* по два атрибута на каждую точку маршрута
+_DEFAULT_FRAME = mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT
+_CMD_LAND = 20  # MAV_CMD_NAV_LAND
+_CMD_RTL = 82   # MAV_CMD_NAV_RETURN_TO_LAUNCH (в .plan QGC)
+
+# Константы протокола миссий/арминга — тоже один раз, а не по два
+# LOAD_ATTR на элемент миссии и на каждый HEARTBEAT в циклах ожидания
+_FRAME_GLOBAL = mavutil.mavlink.MAV_FRAME_GLOBAL
+_FRAME_REL = mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT
+_ARMED_FLAG = mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+_CMD_ARM = mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM
+_CMD_MSTART = mavutil.mavlink.MAV_CMD_MISSION_START
+_MISSION_OK = mavutil.mavlink.MAV_MISSION_ACCEPTED
+_CUSTOM_MODE = mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED
+
+
+@dataclass(slots=True)
+class MissionItem:
+    """
+    Элемент миссии из .plan. Слотовый класс вместо dict на точку:
+    вдвое компактнее и без хеш-поисков при сборке; в dict превращается
+    методом as_dict() только на границе JSON.
+    """
+    seq: int
+    command: int
+    frame: int
+    autoContinue: bool
+    params: list
+    lat: Optional[float]
+    lon: Optional[float]
+    alt: Optional[float]
+
+    def as_dict(self) -> dict:
+        return {
+            "seq": self.seq,
+            "command": self.command,
+            "frame": self.frame,
+            "autoContinue": self.autoContinue,
+            "params": self.params,
+            "lat": self.lat,
+            "lon": self.lon,
+            "alt": self.alt,
+        }
+
+
+def _coord_or_nan(value) -> float:
+    """Координата из params как float; None/мусор превращаем в NaN."""
+    if value is None:
+        return float("nan")
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return float("nan")
+
+
+def validate_qgc_plan(plan_data) -> Optional[str]:
+    """
+    Структурная проверка .plan ДО разбора и сохранения в состояние.
+    Возвращает текст ошибки или None. Ловим кривой ввод одним проходом
+    на границе, чтобы дальше парсер и кодировщик работали без гадания
+    на isinstance и не падали посреди загрузки на борт.
+    """
+    if not isinstance(plan_data, dict):
+        return "plan root must be an object"
+    mission = plan_data.get("mission")
+    if not isinstance(mission, dict):
+        return "plan has no mission object"
+    items = mission.get("items")
+    if not isinstance(items, list):
+        return "mission.items must be a list"
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            return f"mission.items[{idx}] must be an object"
+        if item.get("type") != "SimpleItem":
+            continue
+        cmd = item.get("command")
+        if not isinstance(cmd, int):
+            return f"mission.items[{idx}].command must be an integer"
+        params = item.get("params")
+        if params is not None and not isinstance(params, list):
+            return f"mission.items[{idx}].params must be a list"
+    ph = mission.get("plannedHomePosition")
+    if ph is not None and not isinstance(ph, (list, tuple)):
+        return "mission.plannedHomePosition must be a list"
+    return None
+
+
 def parse_qgc_plan(plan_data):
     """
     Разбор .plan (QGroundControl) в список waypoints и удобный формат для UI.
     Возвращает:
-      items: [{seq, command, frame, autoContinue, params, lat, lon, alt}, ...]
+      items: [MissionItem, ...] (dict для JSON — через .as_dict() у вызывающего)
       waypoints: [[lat, lon], ...] для отрисовки маршрута на карте
 
     Особенности:
@@ -298,38 +751,63 @@ def parse_qgc_plan(plan_data):
         except Exception:
             home_lat = home_lon = None
 
-    items = []
-    waypoints = []
-    need_return_home = False  # флаг: был ли LAND/RTL без координат
-
     eps = 1e-7
 
-    for item in items_raw:
-        if item.get("type") != "SimpleItem":
-            continue
-
-        cmd = int(item.get("command") or 0)
-        frame = int(item.get("frame", mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT))
-        auto_continue = bool(item.get("autoContinue", True))
-
+    # Отбираем SimpleItem и нормализуем params (ровно 7 значений)
+    raw = [item for item in items_raw if item.get("type") == "SimpleItem"]
+    params_list = []
+    for item in raw:
         params = list(item.get("params", []))
         params = params + [0.0] * (7 - len(params))
+        params_list.append(params)
+
+    # Колонки координат: отсутствующие/нечисловые значения → NaN
+    lat_vals = [_coord_or_nan(p[4]) for p in params_list]
+    lon_vals = [_coord_or_nan(p[5]) for p in params_list]
+    alt_vals = [_coord_or_nan(p[6]) for p in params_list]
+    cmds = [int(item.get("command") or 0) for item in raw]
+
+    if np is not None and raw:
+        # Векторный путь: маска "есть координаты" и маршрут считаются
+        # одним проходом по массивам, без интерпретатора на каждой точке
+        lats = np.asarray(lat_vals)
+        lons = np.asarray(lon_vals)
+        # (0,0) считаем "нет координат"
+        has_coords = (
+            ~np.isnan(lats) & ~np.isnan(lons)
+            & (np.abs(lats) > eps) & (np.abs(lons) > eps)
+        )
+        waypoints = np.column_stack([lats, lons])[has_coords].tolist()
+        # LAND/RTL без координат → нужен возврат домой
+        need_return_home = bool(
+            np.any(~has_coords & np.isin(cmds, (_CMD_LAND, _CMD_RTL)))
+        )
+        has_coords = has_coords.tolist()
+    else:
+        has_coords = [
+            not math.isnan(la) and not math.isnan(lo)
+            and abs(la) > eps and abs(lo) > eps  # (0,0) — "нет координат"
+            for la, lo in zip(lat_vals, lon_vals)
+        ]
+        waypoints = [
+            [la, lo] for la, lo, ok in zip(lat_vals, lon_vals, has_coords) if ok
+        ]
+        need_return_home = any(
+            not ok and cmd in (_CMD_LAND, _CMD_RTL)  # LAND/RTL без координат
+            for ok, cmd in zip(has_coords, cmds)
+        )
 
-        lat = None
-        lon = None
-        alt = None
-
-        # Координаты из params[4], [5], [6]
-        if params[4] is not None and params[5] is not None:
-            lat_candidate = float(params[4])
-            lon_candidate = float(params[5])
+    items = []
+    for idx, item in enumerate(raw):
+        frame = int(item.get("frame", _DEFAULT_FRAME))
+        auto_continue = bool(item.get("autoContinue", True))
 
-            # (0,0) считаем "нет координат"
-            if abs(lat_candidate) > eps and abs(lon_candidate) > eps:
-                lat = lat_candidate
-                lon = lon_candidate
-                if params[6] is not None:
-                    alt = float(params[6])
+        lat = lon = alt = None
+        if has_coords[idx]:
+            lat = lat_vals[idx]
+            lon = lon_vals[idx]
+            if not math.isnan(alt_vals[idx]):
+                alt = alt_vals[idx]
 
         # fallback по Altitude
         if alt is None and item.get("Altitude") is not None:
@@ -338,25 +816,16 @@ def parse_qgc_plan(plan_data):
             except Exception:
                 pass
 
-        # Для маршрута на карте:
-        # - если есть нормальные координаты — добавляем точку
-        # - если это LAND/RTL без координат — помечаем, что нужен возврат домой
-        if lat is not None and lon is not None:
-            waypoints.append([lat, lon])
-        else:
-            if cmd in (20, 82):  # LAND или RTL без координат
-                need_return_home = True
-
-        items.append({
-            "seq": int(item.get("doJumpId", len(items) + 1)),
-            "command": cmd,
-            "frame": frame,
-            "autoContinue": auto_continue,
-            "params": params,
-            "lat": lat,
-            "lon": lon,
-            "alt": alt,
-        })
+        items.append(MissionItem(
+            seq=int(item.get("doJumpId", len(items) + 1)),
+            command=cmds[idx],
+            frame=frame,
+            autoContinue=auto_continue,
+            params=params_list[idx],
+            lat=lat,
+            lon=lon,
+            alt=alt,
+        ))
 
     # Если есть домашняя позиция и был LAND/RTL без координат —
     # дорисуем возврат домой в конец маршрута
@@ -383,17 +852,49 @@ COORDLESS_COMMANDS = {
     177,  # MAV_CMD_DO_JUMP
 }
 
+# Битовая маска тех же команд: id команд маленькие, поэтому проверка
+# «команда без координат» — это сдвиг и AND вместо хеширования в set
+_COORDLESS_MASK = 0
+for _cmd in COORDLESS_COMMANDS:
+    _COORDLESS_MASK |= 1 << _cmd
+del _cmd
+
 def safe_float(value) -> float:
-    if value is None:
+    # быстрый путь по точному типу: в .plan почти все params — уже float/int,
+    # generic float() с try/except оставляем только для строк и мусора
+    t = type(value)
+    if t is float:
+        return value
+    if t is int:
+        return float(value)
+    if value is None or value == "":
         return 0.0
     try:
         return float(value)
     except (ValueError, TypeError):
         return 0.0
 
+# sentinel для .get-каскадов: None и 0.0 — валидные значения полей
+_MISSING = object()
+
+_LAT_KEYS = ("x", "lat", "latitude")
+_LON_KEYS = ("y", "lon", "longitude")
+_ALT_KEYS = ("Altitude", "alt", "z", "altitude")
+
+
+def _first_key(item: dict, keys) -> Optional[float]:
+    """Первое присутствующее не-None значение: один .get на ключ вместо
+    пары `in` + индексация (высота 0.0 валидна, поэтому без truthiness)."""
+    for k in keys:
+        v = item.get(k, _MISSING)
+        if v is not _MISSING and v is not None:
+            return v
+    return None
+
+
 def extract_lat_lon_alt(item: dict):
-    params = item.get("params", [])
-    if len(params) >= 7:
+    params = item.get("params")
+    if params and len(params) >= 7:
         lat, lon, alt = params[4:7]
         lat_val = safe_float(lat) if lat is not None else None
         lon_val = safe_float(lon) if lon is not None else None
@@ -401,33 +902,30 @@ def extract_lat_lon_alt(item: dict):
         if lat_val is not None and abs(lat_val) > 1e-7:
             return lat_val, lon_val, alt_val
 
-    for lat_key in ["x", "lat", "latitude"]:
-        if lat_key in item and item[lat_key] is not None:
-            lat_val = safe_float(item[lat_key])
-            lon_val = None
-            alt_val = None
-            for lon_key in ["y", "lon", "longitude"]:
-                if lon_key in item and item[lon_key] is not None:
-                    lon_val = safe_float(item[lon_key])
-                    break
-            for alt_key in ["Altitude", "alt", "z", "altitude"]:
-                if alt_key in item and item[alt_key] is not None:
-                    alt_val = safe_float(item[alt_key])
-                    break
-            if lat_val is not None and abs(lat_val) > 1e-7:
-                return lat_val, lon_val, alt_val
+    for k in _LAT_KEYS:
+        lat = item.get(k, _MISSING)
+        if lat is _MISSING or lat is None:
+            continue
+        lat_val = safe_float(lat)
+        if abs(lat_val) <= 1e-7:
+            continue
+        # lon/alt ищем только когда широта уже прошла проверку
+        lon = _first_key(item, _LON_KEYS)
+        alt = _first_key(item, _ALT_KEYS)
+        lon_val = safe_float(lon) if lon is not None else None
+        alt_val = safe_float(alt) if alt is not None else None
+        return lat_val, lon_val, alt_val
 
     return None, None, None
 
 def get_frame_for_item(item: dict, is_home: bool = False) -> int:
-    return (mavutil.mavlink.MAV_FRAME_GLOBAL if is_home
-            else mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT)
+    return _FRAME_GLOBAL if is_home else _FRAME_REL
 
 def build_mission_items_from_plan(plan_mission: dict, include_home: bool = True):
     items = plan_mission.get("items", [])
-    mission_items = list(items)
 
     planned_home = None
+    home_item = None
     ph = plan_mission.get("plannedHomePosition")
     if include_home and isinstance(ph, (list, tuple)) and len(ph) >= 3:
         try:
@@ -441,87 +939,162 @@ def build_mission_items_from_plan(plan_mission: dict, include_home: bool = True)
                     "Altitude": alt_h,
                     "autoContinue": True,
                     "command": 16,  # MAV_CMD_NAV_WAYPOINT
-                    "frame": mavutil.mavlink.MAV_FRAME_GLOBAL,
+                    "frame": _FRAME_GLOBAL,
                     "params": [0, 0, 0, 0, lat_h, lon_h, alt_h],
                 }
-                mission_items = [home_item] + mission_items
-                print(f"Added home position: lat={lat_h:.6f}, lon={lon_h:.6f}, alt={alt_h:.1f}m")
         except Exception as e:
-            print(f"Warning: Failed to parse home position: {e}")
+            log.warning("Failed to parse home position: %s", e)
+
+    # Одна предвыделенная сборка: раньше копировали items в list(...), а при
+    # наличии home ещё раз в [home] + mission_items — два O(N) прохода
+    if home_item is not None:
+        mission_items = [None] * (len(items) + 1)
+        mission_items[0] = home_item
+        mission_items[1:] = items
+        log.info("Added home position: lat=%.6f, lon=%.6f, alt=%.1fm",
+                 planned_home[0], planned_home[1], planned_home[2])
+    else:
+        mission_items = list(items)
 
     return mission_items, planned_home
 
 def clear_existing_mission(master):
-    print("Clearing existing mission...")
+    log.info("Clearing existing mission...")
     master.mav.mission_clear_all_send(
         master.target_system,
         master.target_component
     )
-    time.sleep(1)
+    # Ждём подтверждение очистки вместо слепого sleep(1): типичный автопилот
+    # отвечает за десятки мс, т.е. почти секунда уходит с пути каждой загрузки.
+    # По таймауту просто продолжаем — как и раньше при слепой паузе.
+    master.recv_match(type='MISSION_ACK', blocking=True, timeout=1.0)
+
+# Размер скользящего окна загрузки: сколько элементов отправляем вперёд,
+# не дожидаясь MISSION_REQUEST на каждый (ArduPilot такие сенды принимает)
+_UPLOAD_WINDOW = 8
+
+
+def _encode_item(seq: int, item: dict, is_home: bool = False):
+    """
+    Кодирует элемент миссии в кортеж аргументов mission_item_int_send
+    (frame, cmd, current, autocontinue, p1..p4, x_int, y_int, alt).
+    """
+    cmd = int(item.get('command', 0))
+    frame = get_frame_for_item(item, is_home=is_home)
+
+    params = item.get('params', [])
+    n = len(params)
+    p1 = safe_float(params[0]) if n > 0 else 0.0
+    p2 = safe_float(params[1]) if n > 1 else 0.0
+    p3 = safe_float(params[2]) if n > 2 else 0.0
+    p4 = safe_float(params[3]) if n > 3 else 0.0
+
+    lat, lon, alt = extract_lat_lon_alt(item)
+    alt_val = safe_float(alt) if alt is not None else 0.0
+
+    if (_COORDLESS_MASK >> cmd) & 1:
+        x_int, y_int = 0, 0
+    elif lat is None or lon is None:
+        if cmd == 16:  # MAV_CMD_NAV_WAYPOINT
+            raise ValueError(f"Waypoint {seq} requires coordinates but none found")
+        else:
+            x_int, y_int = 0, 0
+            log.warning("Item %d (cmd=%d) has no coordinates, using (0,0)", seq, cmd)
+    else:
+        # масштабирование в 1e7 без generic round(): для этих величин
+        # сдвиг на полшага и усечение дают тот же результат дешевле
+        x_int = int(lat * 1e7 + (0.5 if lat >= 0 else -0.5))
+        y_int = int(lon * 1e7 + (0.5 if lon >= 0 else -0.5))
+
+    return (frame, cmd, 0, 1, p1, p2, p3, p4, x_int, y_int, alt_val)
+
 
 def upload_mission_to_autopilot(master, mission_items, planned_home=None):
     target_system = master.target_system
     target_component = master.target_component
+    total = len(mission_items)
+
+    log.info("Uploading mission with %d items", total)
+
+    # Кодируем все элементы заранее: повторный MISSION_REQUEST стоит один
+    # индексный доступ вместо повторного разбора dict, а ошибки координат
+    # всплывают ещё ДО того, как мы стёрли миссию на борту
+    encoded = [
+        _encode_item(seq, item, is_home=(seq == 0 and planned_home is not None))
+        for seq, item in enumerate(mission_items)
+    ]
 
-    print(f"Uploading mission with {len(mission_items)} items")
     clear_existing_mission(master)
 
-    master.mav.mission_count_send(target_system, target_component, len(mission_items))
+    master.mav.mission_count_send(target_system, target_component, total)
 
-    for _ in range(len(mission_items)):
+    def _send_item(seq: int) -> None:
+        enc = encoded[seq]
+        master.mav.mission_item_int_send(
+            target_system, target_component, seq, *enc
+        )
+        log.debug("Sent item %d: cmd=%d, alt=%s", seq, enc[1], enc[10])
+
+    # Скользящее окно: первые K элементов уходят сразу, дальше на каждый
+    # MISSION_REQUEST(seq=s) шлём s+K. Вместо RTT на элемент автопилот
+    # почти всегда находит следующий элемент уже в своём буфере.
+    for seq in range(min(_UPLOAD_WINDOW, total)):
+        _send_item(seq)
+
+    highest_req = -1  # самый дальний уже обработанный запрос (для дедупликации)
+    ack = None
+    while ack is None:
+        # пока борт догоняет окно — ждём запросы, после последнего — только ACK
+        timeout = TIMEOUT_ACK if highest_req >= total - 1 else TIMEOUT_REQUEST
+        # быстрый путь: после свежего send ответ обычно уже лежит в буфере
+        # сокета — забираем его без блокирующего ожидания
         msg = master.recv_match(
-            type=['MISSION_REQUEST_INT', 'MISSION_REQUEST'],
-            blocking=True,
-            timeout=TIMEOUT_REQUEST
+            type=['MISSION_REQUEST_INT', 'MISSION_REQUEST', 'MISSION_ACK'],
+            blocking=False
         )
         if msg is None:
+            msg = master.recv_match(
+                type=['MISSION_REQUEST_INT', 'MISSION_REQUEST', 'MISSION_ACK'],
+                blocking=True,
+                timeout=timeout
+            )
+        if msg is None:
+            if highest_req >= total - 1:
+                # все элементы отправлены, потерялся только ACK — не фатально
+                break
             raise TimeoutError("No MISSION_REQUEST received")
 
-        req_seq = msg.seq
-        if req_seq >= len(mission_items):
-            raise ValueError(f"Requested sequence {req_seq} beyond mission length {len(mission_items)}")
-
-        item = mission_items[req_seq]
-        cmd = int(item.get('command', 0))
-        frame = get_frame_for_item(item, is_home=(req_seq == 0 and planned_home is not None))
-
-        params = item.get('params', [])
-        p1 = safe_float(params[0]) if len(params) > 0 else 0.0
-        p2 = safe_float(params[1]) if len(params) > 1 else 0.0
-        p3 = safe_float(params[2]) if len(params) > 2 else 0.0
-        p4 = safe_float(params[3]) if len(params) > 3 else 0.0
+        if msg.get_type() == 'MISSION_ACK':
+            if total > 0 and highest_req < 0:
+                # ACK до первого MISSION_REQUEST — это запоздалое подтверждение
+                # mission_clear_all (его ожидание в clear_existing_mission могло
+                # выйти по таймауту), а не ответ на нашу загрузку. Игнорируем.
+                log.debug("[MISSION] Stray MISSION_ACK before first request, ignoring")
+                continue
+            ack = msg
+            break
 
-        lat, lon, alt = extract_lat_lon_alt(item)
-        alt_val = safe_float(alt) if alt is not None else 0.0
+        req_seq = msg.seq
+        if req_seq >= total:
+            raise ValueError(f"Requested sequence {req_seq} beyond mission length {total}")
 
-        if cmd in COORDLESS_COMMANDS:
-            x_int, y_int = 0, 0
-        elif lat is None or lon is None:
-            if cmd == 16:  # MAV_CMD_NAV_WAYPOINT
-                raise ValueError(f"Waypoint {req_seq} requires coordinates but none found")
-            else:
-                x_int, y_int = 0, 0
-                print(f"Warning: Item {req_seq} (cmd={cmd}) has no coordinates, using (0,0)")
-        else:
-            x_int = int(round(lat * 1e7))
-            y_int = int(round(lon * 1e7))
+        if req_seq <= highest_req:
+            # повторный запрос — ретрансляция конкретного элемента
+            _send_item(req_seq)
+            continue
 
-        master.mav.mission_item_int_send(
-            target_system, target_component, req_seq, frame, cmd,
-            0, 1,
-            p1, p2, p3, p4,
-            x_int, y_int, alt_val
-        )
-        print(f"Sent item {req_seq}: cmd={cmd}, lat={lat}, lon={lon}, alt={alt_val}")
+        highest_req = req_seq
+        next_seq = req_seq + _UPLOAD_WINDOW
+        if next_seq < total:
+            _send_item(next_seq)
 
-    ack = master.recv_match(type=['MISSION_ACK'], timeout=TIMEOUT_ACK)
-    print(f"[MISSION] MISSION_ACK received: {ack}")
+    log.info("[MISSION] MISSION_ACK received: %s", ack)
 
     if not ack:
         print("⚠️ No MISSION_ACK received, assuming mission is loaded (all items sent)")
         return True
 
-    if getattr(ack, "type", None) == mavutil.mavlink.MAV_MISSION_ACCEPTED:
+    if getattr(ack, "type", None) == _MISSION_OK:
         print("✓ Mission upload accepted")
         return True
     else:
@@ -531,35 +1104,104 @@ def upload_mission_to_autopilot(master, mission_items, planned_home=None):
 
 # --- запуск миссии (AUTO + MISSION_START) ---
 
+# Кэш mode_mapping() по соединению: pymavlink пересобирает словарь режимов
+# на каждый вызов, а таблица режимов меняется только со сменой автопилота
+_MODE_MAPPING_CACHE = {}
+
+
+def _mode_map(master) -> dict:
+    key = id(master)
+    m = _MODE_MAPPING_CACHE.get(key)
+    if m is None:
+        m = master.mode_mapping()
+        _MODE_MAPPING_CACHE[key] = m
+    return m
+
+
+# Готовый ID режима аварийной остановки по соединению: «стоп» из UI должен
+# уходить одним кадром, без сборки таблицы режимов в момент нажатия
+_STOP_MODE_ID = {}
+
+
+def _stop_mode_id(master) -> Optional[int]:
+    """ID первого доступного из BRAKE/LOITER/ALT_HOLD (None, если нет)."""
+    key = id(master)
+    if key in _STOP_MODE_ID:
+        return _STOP_MODE_ID[key]
+    try:
+        mapping = _mode_map(master)
+    except Exception:
+        return None  # не кэшируем неудачу — попробуем при следующем вызове
+    mode_id = None
+    for candidate in ("BRAKE", "LOITER", "ALT_HOLD"):
+        if candidate in mapping:
+            mode_id = mapping[candidate]
+            break
+    _STOP_MODE_ID[key] = mode_id
+    return mode_id
+
+def _drain_until(master, wanted_types, handle, timeout: float):
+    """
+    Пакетный приём сообщений нужных типов: сперва вычерпываем всё, что уже
+    лежит в буфере (blocking=False), и лишь когда прогресса нет — одно
+    короткое блокирующее ожидание. handle(msg) возвращает не-None, когда
+    ответ получен; по таймауту возвращаем None.
+    """
+    # monotonic: шаг системных часов (NTP) не должен сжимать/растягивать окно
+    deadline = time.monotonic() + timeout
+    while True:
+        progressed = False
+        while True:
+            msg = master.recv_match(type=wanted_types, blocking=False)
+            if msg is None:
+                break
+            progressed = True
+            res = handle(msg)
+            if res is not None:
+                return res
+        if time.monotonic() >= deadline:
+            return None
+        if not progressed:
+            msg = master.recv_match(type=wanted_types, blocking=True, timeout=0.2)
+            if msg is not None:
+                res = handle(msg)
+                if res is not None:
+                    return res
+
+
 def check_armed(master, timeout: int = 3) -> bool:
     """Проверка по HEARTBEAT, что борт армлен."""
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        msg = master.recv_match(type='HEARTBEAT', blocking=True, timeout=1)
-        if msg:
-            return (msg.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED) != 0
-    return False
+    res = _drain_until(
+        master, ['HEARTBEAT'],
+        lambda msg: (msg.base_mode & _ARMED_FLAG) != 0,
+        timeout,
+    )
+    return bool(res)
 
 def set_mode(master, mode: str, timeout: int = 10) -> bool:
-    print(f"Setting mode to {mode}...")
-    mode_mapping = master.mode_mapping()
+    log.info("Setting mode to %s...", mode)
+    mode_mapping = _mode_map(master)
     if mode not in mode_mapping:
-        print(f"Unknown mode: {mode}")
+        log.warning("Unknown mode: %s", mode)
         return False
 
+    want = mode_mapping[mode]
     master.mav.set_mode_send(
         master.target_system,
-        mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
-        mode_mapping[mode]
+        _CUSTOM_MODE,
+        want
     )
 
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        msg = master.recv_match(type=['HEARTBEAT'], blocking=True, timeout=1)
-        if msg and msg.custom_mode == mode_mapping[mode]:
-            print(f"✓ Mode {mode} set successfully")
-            return True
-    print(f"[MODE] Timeout while setting {mode}")
+    # не-None только при совпадении режима — остальные HEARTBEAT пропускаем
+    ok = _drain_until(
+        master, ['HEARTBEAT'],
+        lambda msg: True if msg.custom_mode == want else None,
+        timeout,
+    )
+    if ok:
+        log.info("Mode %s set successfully", mode)
+        return True
+    log.warning("[MODE] Timeout while setting %s", mode)
     return False
 
 def arm_copter(master, arm: bool = True, timeout: int = 10) -> bool:
@@ -568,40 +1210,40 @@ def arm_copter(master, arm: bool = True, timeout: int = 10) -> bool:
     Не полагаемся только на COMMAND_ACK, ждём HEARTBEAT с изменённым флагом.
     """
     action = "arm" if arm else "disarm"
-    print(f"Attempting to {action} copter...")
+    log.info("Attempting to %s copter...", action)
 
     master.mav.command_long_send(
         master.target_system, master.target_component,
-        mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0,
+        _CMD_ARM, 0,
         1 if arm else 0, 0, 0, 0, 0, 0, 0
     )
 
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        msg = master.recv_match(
-            type=['HEARTBEAT', 'STATUSTEXT', 'COMMAND_ACK'],
-            blocking=True,
-            timeout=1
-        )
-        if not msg:
-            continue
-
+    def on_msg(msg):
         mtype = msg.get_type()
 
         if mtype == 'HEARTBEAT':
-            armed_now = (msg.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED) != 0
+            armed_now = (msg.base_mode & _ARMED_FLAG) != 0
             if armed_now == arm:
-                print(f"✓ Copter successfully {'armed' if arm else 'disarmed'} (by HEARTBEAT)!")
+                log.info("Copter successfully %s (by HEARTBEAT)", "armed" if arm else "disarmed")
                 return True
 
-        elif mtype == 'COMMAND_ACK' and msg.command == mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM:
-            print(f"[ARM] COMMAND_ACK: result={msg.result}")
+        elif mtype == 'COMMAND_ACK' and msg.command == _CMD_ARM:
+            log.debug("[ARM] COMMAND_ACK: result=%s", msg.result)
 
         elif mtype == 'STATUSTEXT':
-            text = msg.text.decode('utf-8') if isinstance(msg.text, bytes) else str(msg.text)
-            print(f"[ARM] STATUSTEXT: {text}")
+            # декодируем только если DEBUG реально включён: при неудачном
+            # арминге борт сыплет STATUSTEXT десятками, а текст нужен лишь логу
+            if log.isEnabledFor(logging.DEBUG):
+                raw = msg.text
+                text = raw.decode('utf-8', 'replace') if type(raw) is bytes else raw
+                log.debug("[ARM] STATUSTEXT: %s", text)
+
+        return None
+
+    if _drain_until(master, ['HEARTBEAT', 'STATUSTEXT', 'COMMAND_ACK'], on_msg, timeout):
+        return True
 
-    print(f"[ARM] Timeout, failed to {action} copter")
+    log.warning("[ARM] Timeout, failed to %s copter", action)
     return False
 
 def start_mission_auto(master, mission_items, takeoff_altitude: float = 10.0, uav_id: Optional[str] = None) -> bool:
@@ -611,11 +1253,11 @@ def start_mission_auto(master, mission_items, takeoff_altitude: float = 10.0, ua
        армим.
     2) Ставим AUTO.
     3) Отправляем MAV_CMD_MISSION_START.
-    Прогресс отслеживается в listen_to_uav по MISSION_CURRENT/STATUSTEXT.
+    Прогресс отслеживается циклом телеметрии по MISSION_CURRENT/STATUSTEXT.
     """
     print("Starting mission in AUTO mode using MAV_CMD_MISSION_START...")
 
-    mode_mapping = master.mode_mapping()
+    mode_mapping = _mode_map(master)
     pre_arm_mode = None
     for candidate in ["GUIDED", "LOITER", "STABILIZE", "ALT_HOLD"]:
         if candidate in mode_mapping:
@@ -624,7 +1266,20 @@ def start_mission_auto(master, mission_items, takeoff_altitude: float = 10.0, ua
     if pre_arm_mode is None and mode_mapping:
         pre_arm_mode = list(mode_mapping.keys())[0]
 
-    if not check_armed(master):
+    # Сначала смотрим состояние арминга из телеметрии: если HEARTBEAT
+    # приходил < 2 с назад, не тратим до 3 с на опрос в check_armed
+    armed = None
+    if uav_id is not None:
+        uav_lock = UAV_LOCKS.get(uav_id)
+        if uav_lock is not None:
+            with uav_lock:
+                uav = UAVS.get(uav_id)
+                if uav is not None and time.monotonic() - uav.get("armed_ts", 0.0) < 2.0:
+                    armed = uav.get("armed")
+    if armed is None:
+        armed = check_armed(master)
+
+    if not armed:
         print(f"[AUTO] Drone is not armed, switching to {pre_arm_mode} before arming...")
         if pre_arm_mode and not set_mode(master, pre_arm_mode, timeout=10):
             print(f"[AUTO] Failed to set pre-arm mode {pre_arm_mode}")
@@ -650,7 +1305,7 @@ def start_mission_auto(master, mission_items, takeoff_altitude: float = 10.0, ua
     master.mav.command_long_send(
         master.target_system,
         master.target_component,
-        mavutil.mavlink.MAV_CMD_MISSION_START,
+        _CMD_MSTART,
         0,
         0,
         0, 0, 0, 0, 0, 0
@@ -671,6 +1326,15 @@ def upload_and_start_mission_for_uav(uav_id: str, takeoff_altitude: float = 10.0
     На время загрузки/арминга ставит mission_comm_lock=True, чтобы телеметрия не читала сокет.
     """
     with uavs_lock:
+        master = MAVLINK_CONNECTIONS.get(uav_id)
+        uav_lock = UAV_LOCKS.get(uav_id)
+
+    if uav_lock is None:
+        raise RuntimeError("БВС не подключен")
+    if not master:
+        raise RuntimeError("Нет MAVLink-соединения для БВС")
+
+    with uav_lock:
         uav = UAVS.get(uav_id)
         if not uav:
             raise RuntimeError("БВС не подключен")
@@ -678,10 +1342,7 @@ def upload_and_start_mission_for_uav(uav_id: str, takeoff_altitude: float = 10.0
         plan_data = uav.get("plan_raw")
         if not plan_data:
             raise RuntimeError("Для БВС не загружен .plan")
-
-        master = MAVLINK_CONNECTIONS.get(uav_id)
-        if not master:
-            raise RuntimeError("Нет MAVLink-соединения для БВС")
+        prepared = uav.get("_prepared_mission")
 
         # Включаем блокировку чтения в телеметрийном потоке
         uav["mission_comm_lock"] = True
@@ -695,9 +1356,14 @@ def upload_and_start_mission_for_uav(uav_id: str, takeoff_altitude: float = 10.0
             mission_progress=0.0,
         )
 
-        mission_items, planned_home = build_mission_items_from_plan(
-            plan_data.get("mission", {})
-        )
+        if prepared is not None:
+            # кортеж подготовлен при загрузке .plan; инвалидация — запись
+            # нового кортежа при следующем upload
+            mission_items, planned_home = prepared
+        else:
+            mission_items, planned_home = build_mission_items_from_plan(
+                plan_data.get("mission", {})
+            )
         print(f"[MISSION] Loaded {len(mission_items)} mission items for {uav_id}")
 
         update_mission_state(
@@ -720,7 +1386,7 @@ def upload_and_start_mission_for_uav(uav_id: str, takeoff_altitude: float = 10.0
 
     finally:
         # Снимаем блокировку чтения — телеметрия снова начинает читать сокет
-        with uavs_lock:
+        with uav_lock:
             if uav_id in UAVS:
                 UAVS[uav_id]["mission_comm_lock"] = False
         print("[MISSION] mission_comm_lock released")
@@ -729,7 +1395,7 @@ def upload_and_start_mission_for_uav(uav_id: str, takeoff_altitude: float = 10.0
 def stop_mission_on_uav(uav_id: str):
     """
     Остановка миссии: перевод в LOITER/BRAKE/ALT_HOLD и пометка миссии как stopped.
-    После этого listen_to_uav перестаёт учитывать MISSION_CURRENT.
+    После этого обработчик MISSION_CURRENT перестаёт учитывать прогресс.
     """
     with uavs_lock:
         master = MAVLINK_CONNECTIONS.get(uav_id)
@@ -739,15 +1405,13 @@ def stop_mission_on_uav(uav_id: str):
         raise RuntimeError("Нет подключения к БВС")
 
     try:
-        mode_mapping = master.mode_mapping()
-        # пробуем по приоритету от более «резких» к более мягким
-        for candidate in ["BRAKE", "LOITER", "ALT_HOLD"]:
-            if candidate in mode_mapping:
-                print(f"[STOP] Switching {uav_id} to {candidate}")
-                # тут ОСОЗНАННО используем master.set_mode (без ожидания),
-                # чтобы не спорить с телеметрийным потоком за HEARTBEAT
-                master.set_mode(candidate)
-                break
+        # режим (BRAKE/LOITER/ALT_HOLD) подобран заранее при подключении:
+        # отправляем один set_mode_send без ожидания подтверждения, чтобы
+        # не собирать таблицы режимов и не спорить с телеметрией за HEARTBEAT
+        mode_id = _stop_mode_id(master)
+        if mode_id is not None:
+            print(f"[STOP] Switching {uav_id} to stop mode (id={mode_id})")
+            master.mav.set_mode_send(master.target_system, _CUSTOM_MODE, mode_id)
         else:
             # если ни один из режимов не найден — fallback на LOITER_UNLIM командой
             print(f"[STOP] {uav_id}: no BRAKE/LOITER/ALT_HOLD, sending MAV_CMD_NAV_LOITER_UNLIM")
@@ -788,13 +1452,45 @@ def mission_runner(uav_id: str, takeoff_altitude: float) -> None:
         )
 
 
-# --- Старт фоновых потоков ---
-print("[INIT] Запуск одноразового обнаружения БВС на портах 14550...")
-discover_thread = threading.Thread(target=discover_uavs, daemon=True)
-discover_thread.start()
+# --- Фоновые задачи ---
+# Один управляющий поток с sched.scheduler вместо отдельного потока
+# на каждую периодическую задачу: меньше потоков, меньше пустых пробуждений.
+scheduler = sched.scheduler(time.monotonic, time.sleep)
+
+DISCOVER_INTERVAL = 30       # сек между пересканированиями портов
+HEARTBEAT_CHECK_INTERVAL = 5  # сек между проверками активности
+
+
+def _schedule_periodic(interval: float, action, delay: float = 0.0) -> None:
+    """Ставит action в планировщик с самоперепланированием каждые interval сек."""
+    def tick():
+        try:
+            action()
+        except Exception as e:
+            print(f"[SCHED] Ошибка задачи {action.__name__}: {e}")
+        scheduler.enter(interval, 1, tick)
 
-heartbeat_thread = threading.Thread(target=check_heartbeats, daemon=True)
-heartbeat_thread.start()
+    scheduler.enter(delay, 1, tick)
+
+
+print("[INIT] Запуск обнаружения БВС на портах 14550...")
+_schedule_periodic(DISCOVER_INTERVAL, discover_uavs)
+_schedule_periodic(HEARTBEAT_CHECK_INTERVAL, check_heartbeats,
+                   delay=HEARTBEAT_CHECK_INTERVAL)
+
+control_thread = threading.Thread(target=scheduler.run, daemon=True)
+control_thread.start()
+
+snapshot_thread = threading.Thread(target=_snapshot_rebuilder, daemon=True)
+snapshot_thread.start()
+
+# Один поток телеметрии на все борта (см. telemetry_loop)
+telemetry_thread = threading.Thread(target=telemetry_loop, daemon=True)
+telemetry_thread.start()
+
+# Consumer очереди принятых сообщений (см. _rx_consumer)
+rx_thread = threading.Thread(target=_rx_consumer, daemon=True)
+rx_thread.start()
 
 
 # --- ROUTES ---
@@ -807,34 +1503,59 @@ def index():
     return render_template("index.html", uavs=uavs_list, first_mission=first_mission)
 
 
+# Кэш ответа /uavs: (версия данных, готовые JSON-байты).
+# Кортеж подменяется целиком, поэтому читается без лока.
+_uavs_cache = (-1, b"[]")
+
+
 @app.route("/uavs")
 def get_uavs():
-    uavs_list = get_serializable_uavs()
-    return jsonify(uavs_list)
+    global _uavs_cache
+    version = _data_version
+
+    # ETag от версии данных: если у клиента уже актуальный JSON —
+    # отвечаем пустым 304 вместо повторной отправки всего списка
+    etag = str(version)
+    if request.if_none_match.contains_weak(etag):
+        return "", 304
+
+    cached_version, body = _uavs_cache
+    if cached_version != version:
+        # Состояние изменилось — сериализуем один раз, дальше все опросы
+        # фронта получают эти же байты, пока версия не сдвинется
+        body = _json_bytes(get_serializable_uavs())
+        _uavs_cache = (version, body)
+
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    return response
 
 
 @app.route("/uavs/<uav_id>/mission", methods=["GET", "POST"])
 def mission(uav_id):
     with uavs_lock:
-        if uav_id not in UAVS:
-            return jsonify({"error": "not found"}), 404
+        uav_lock = UAV_LOCKS.get(uav_id)
+    if uav_lock is None:
+        return jsonify({"error": "not found"}), 404
 
     if request.method == "GET":
-        with uavs_lock:
-            return jsonify({"items": UAVS[uav_id]["mission"]})
+        with uav_lock:
+            return fast_json({"items": UAVS[uav_id]["mission"]})
 
     data = request.get_json(silent=True) or {}
-    with uavs_lock:
+    with uav_lock:
         UAVS[uav_id]["mission"] = data.get("items", [])
-    return jsonify({"status": "ok"})
+    _mark_dirty()
+    return fast_json({"status": "ok"})
 
 
 @app.route("/uavs/<uav_id>/mission/upload", methods=["POST"])
 def upload_mission(uav_id):
     """Загрузка .plan с фронта (multipart/form-data, поле 'file')."""
     with uavs_lock:
-        if uav_id not in UAVS:
-            return jsonify({"error": "UAV not found"}), 404
+        uav_lock = UAV_LOCKS.get(uav_id)
+    if uav_lock is None:
+        return jsonify({"error": "UAV not found"}), 404
 
     if "file" not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
@@ -845,15 +1566,27 @@ def upload_mission(uav_id):
     except Exception as e:
         return jsonify({"error": f"Failed to parse JSON: {e}"}), 400
 
+    plan_error = validate_qgc_plan(plan_data)
+    if plan_error is not None:
+        return jsonify({"error": f"Invalid .plan: {plan_error}"}), 400
+
     items, waypoints = parse_qgc_plan(plan_data)
+    # граница JSON: дальше элементы живут в состоянии и ответах как dict
+    items = [it.as_dict() for it in items]
+
+    # Сразу готовим элементы для загрузки на борт: старт миссии (и каждый
+    # повторный старт) берёт готовый кортеж вместо повторного разбора .plan
+    prepared = build_mission_items_from_plan(plan_data.get("mission", {}))
 
     eps = 1e-7
-    with uavs_lock:
+    with uav_lock:
         uav = UAVS[uav_id]
         uav_lat = uav.get("lat") or 0.0
         uav_lon = uav.get("lon") or 0.0
-        UAVS[uav_id]["mission"] = items
-        UAVS[uav_id]["plan_raw"] = plan_data
+        uav["mission"] = items
+        uav["plan_raw"] = plan_data
+        uav["_prepared_mission"] = prepared
+    _mark_dirty()
 
     # Добавляем текущую позицию БВС в начало маршрута (если она не (0,0) и не совпадает с первой точкой)
     if waypoints and abs(uav_lat) > eps and abs(uav_lon) > eps:
@@ -861,7 +1594,7 @@ def upload_mission(uav_id):
         if abs(first_lat - uav_lat) > eps or abs(first_lon - uav_lon) > eps:
             waypoints = [[uav_lat, uav_lon]] + waypoints
 
-    return jsonify({
+    return fast_json({
         "status": "ok",
         "items": items,
         "waypoints": waypoints
@@ -874,9 +1607,11 @@ def start_mission(uav_id):
     takeoff_alt = float(data.get("takeoff_altitude", 10.0)) if isinstance(data, dict) else 10.0
 
     with uavs_lock:
-        if uav_id not in UAVS:
-            return jsonify({"error": "UAV not found"}), 404
+        uav_lock = UAV_LOCKS.get(uav_id)
+    if uav_lock is None:
+        return jsonify({"error": "UAV not found"}), 404
 
+    with uav_lock:
         status = UAVS[uav_id].get("mission_status", "idle")
         if status in ("starting", "running"):
             return jsonify({"error": "mission already in progress"}), 400
@@ -896,7 +1631,8 @@ def start_mission(uav_id):
     )
     thread.start()
 
-    return jsonify({"status": "started"})
+    # 202: загрузка/старт идут в фоне, прогресс виден через /uavs
+    return jsonify({"status": "started"}), 202
 
 
 @app.route("/uavs/<uav_id>/mission/stop", methods=["POST"])
@@ -912,17 +1648,30 @@ def stop_mission(uav_id):
 def disconnect_uav(uav_id):
     """Принудительное отключение БВС."""
     with uavs_lock:
+        uav_lock = UAV_LOCKS.get(uav_id)
+        master = MAVLINK_CONNECTIONS.pop(uav_id, None)
+        if uav_lock is not None:
+            # Запоминаем выбор пользователя, иначе периодический discover
+            # переподключит борт на следующем проходе
+            USER_DISCONNECTED.add(uav_id)
+    if uav_lock is None:
+        return jsonify({"error": "not found"}), 404
+
+    if master:
+        # кэши по id(master) — убираем вместе с соединением
+        _MODE_MAPPING_CACHE.pop(id(master), None)
+        _STOP_MODE_ID.pop(id(master), None)
+        try:
+            master.close()
+        except Exception:
+            pass
+
+    with uav_lock:
         if uav_id in UAVS:
             UAVS[uav_id]["connected"] = False
             UAVS[uav_id]["status"] = "offline"
-            if uav_id in MAVLINK_CONNECTIONS:
-                try:
-                    MAVLINK_CONNECTIONS[uav_id].close()
-                except Exception:
-                    pass
-                del MAVLINK_CONNECTIONS[uav_id]
-            return jsonify({"status": "disconnected"})
-    return jsonify({"error": "not found"}), 404
+    _mark_dirty()
+    return jsonify({"status": "disconnected"})
 
 
 @app.route("/refresh_uavs")
@@ -932,50 +1681,77 @@ def refresh_uavs():
     Никаких пересканирований — просто возвращаем текущее состояние.
     """
     uavs_list = get_serializable_uavs()
-    return jsonify({
+    return fast_json({
         "active_uavs": len(uavs_list),
         "uavs": [uav["name"] for uav in uavs_list],
         "items": uavs_list,
     })
 
 
+# Общая сессия для внешних погодных API: TCP+TLS handshake платим один раз,
+# дальше соединения живут в keep-alive пуле
+WEATHER_SESSION = requests.Session()
+WEATHER_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=1),
+)
+WEATHER_SESSION.headers["User-Agent"] = "RepkaPi-Weather/1.0"
+
+# TTL кэша погоды: ключ — сетка ~1 км (round до 2 знаков) + 10-минутное окно
+WEATHER_TTL = 600
+
+
+@lru_cache(maxsize=256)
+def _current_weather(lat_r: float, lon_r: float, ttl_bucket: int) -> dict:
+    """Текущая погода Open-Meteo по округлённой точке (кэш на WEATHER_TTL)."""
+    w = WEATHER_SESSION.get(
+        "https://api.open-meteo.com/v1/forecast"
+        f"?latitude={lat_r}&longitude={lon_r}&current_weather=true",
+        timeout=5,
+    )
+    return w.json().get("current_weather", {}) or {}
+
+
+@lru_cache(maxsize=256)
+def _reverse_geocode(lat_r: float, lon_r: float) -> str:
+    """Название места по координатам (Nominatim OSM); геокод точки не меняется."""
+    loc = WEATHER_SESSION.get(
+        "https://nominatim.openstreetmap.org/reverse"
+        f"?format=json&lat={lat_r}&lon={lon_r}&zoom=10&addressdetails=1",
+        timeout=5,
+    ).json()
+    addr = loc.get("address", {}) or {}
+    return (
+        addr.get("city") or addr.get("town") or addr.get("village")
+        or addr.get("state") or "Неизвестное место"
+    )
+
+
 @app.route("/weather")
 def weather():
     """
     Бесплатная погода: Open-Meteo + обратное геокодирование (Nominatim OSM),
     чтобы "name" был похож на город/регион по координатам.
+    Ответы кэшируются по ~1 км ячейке, погода — на WEATHER_TTL секунд.
     """
     lat = request.args.get("lat", type=float)
     lon = request.args.get("lon", type=float)
     if lat is None or lon is None:
         return jsonify({"error": "lat/lon required"}), 400
 
+    lat_r = round(lat, 2)
+    lon_r = round(lon, 2)
+
     try:
-        w_url = (
-            "https://api.open-meteo.com/v1/forecast"
-            f"?latitude={lat}&longitude={lon}&current_weather=true"
-        )
-        w = requests.get(w_url, timeout=5)
-        w_data = w.json()
-        current = w_data.get("current_weather", {}) or {}
+        current = _current_weather(lat_r, lon_r, int(time.time() // WEATHER_TTL))
 
         location_name = "Неизвестное место"
         try:
-            loc = requests.get(
-                "https://nominatim.openstreetmap.org/reverse"
-                f"?format=json&lat={lat}&lon={lon}&zoom=10&addressdetails=1",
-                headers={"User-Agent": "RepkaPi-Weather/1.0"},
-                timeout=5,
-            ).json()
-            addr = loc.get("address", {}) or {}
-            location_name = (
-                addr.get("city") or addr.get("town") or addr.get("village")
-                or addr.get("state") or "Неизвестное место"
-            )
+            location_name = _reverse_geocode(lat_r, lon_r)
         except Exception:
             pass
 
-        return jsonify({
+        return fast_json({
             "name": location_name,
             "temp": current.get("temperature", 0),
             "description": f"ветер {current.get('windspeed', 0)} м/с",
@@ -987,4 +1763,8 @@ def weather():
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5555, debug=True)
+    # Dev-запуск через встроенный сервер Werkzeug.
+    # Для продакшна: gunicorn -c gunicorn_conf.py app:app
+    # debug=False обязательно: reloader импортирует модуль дважды, т.е.
+    # заводит второй набор фоновых потоков и MAVLink-соединений
+    app.run(host="0.0.0.0", port=5555, debug=False, threaded=True)
@@ -0,0 +1,17 @@
+"""
+Конфигурация gunicorn для продакшн-запуска Flask Web UI:
+
+    gunicorn -c gunicorn_conf.py app:app
+
+Воркер gevent монки-патчит socket до импорта app, поэтому HTTP-запросы и
+исходящие вызовы requests в /weather становятся кооперативными, а один
+воркер держит сотни одновременных опросов /uavs без потока на соединение.
+"""
+
+bind = "0.0.0.0:5555"
+
+# Один воркер обязательно: состояние БВС и MAVLink-соединения живут в памяти
+# процесса, второй воркер завёл бы собственный независимый набор соединений.
+workers = 1
+worker_class = "gevent"
+worker_connections = 1000